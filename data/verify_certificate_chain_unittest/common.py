@@ -511,6 +511,17 @@ def init(invoking_script_path):
   os.makedirs(g_tmp_dir)
 
 
+def reset(invoking_script_path):
+  """Restores the module state to what it was when first imported, and calls
+  init() for a new invoking script. This allows several generate-chains.py
+  scripts to be run from within the same process (see generate-all.py)."""
+
+  global g_cur_path_id
+  g_cur_path_id = {}
+  set_default_validity_range(JANUARY_1_2015_UTC, JANUARY_1_2016_UTC)
+  init(invoking_script_path)
+
+
 def create_self_signed_root_certificate(name):
   return Certificate(name, TYPE_CA, None)
 
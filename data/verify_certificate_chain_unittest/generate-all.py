@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs all of the generate-chains.py scripts and cleans up the temp files
+afterwards.
+
+The scripts are all run from within this one python process, so interpreter
+startup and the import of common are only paid for once rather than once per
+directory.
+"""
+
+import os
+import runpy
+import shutil
+import sys
+
+GENERATE_CHAINS_SCRIPT = 'generate-chains.py'
+
+
+def run_generate_chains(script_dir):
+  """Runs |script_dir|/generate-chains.py as though it had been invoked from
+  within |script_dir|."""
+  os.chdir(script_dir)
+
+  # common.init() is run when the first script imports common. Subsequent
+  # scripts get the already imported module, so reset it for them instead.
+  sys.argv = [GENERATE_CHAINS_SCRIPT]
+  if 'common' in sys.modules:
+    sys.modules['common'].reset(GENERATE_CHAINS_SCRIPT)
+
+  # The scripts append '..' to sys.path in order to import common.
+  saved_path = list(sys.path)
+  try:
+    runpy.run_path(GENERATE_CHAINS_SCRIPT, run_name='__main__')
+  finally:
+    sys.path = saved_path
+
+  # Cleanup temporary files.
+  shutil.rmtree('out', True)
+
+
+def main():
+  sys.dont_write_bytecode = True
+
+  base_dir = os.path.dirname(os.path.realpath(__file__))
+  for name in sorted(os.listdir(base_dir)):
+    script_dir = os.path.join(base_dir, name)
+    if os.path.isfile(os.path.join(script_dir, GENERATE_CHAINS_SCRIPT)):
+      run_generate_chains(script_dir)
+
+
+if __name__ == '__main__':
+  main()
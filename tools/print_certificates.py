@@ -7,21 +7,67 @@
 
 import argparse
 import base64
+import collections
+import distutils.spawn
 import errno
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
+import socket
+import ssl
 import subprocess
 import sys
 
 
+# The tools that are run, resolved once rather than searching PATH on every
+# invocation. If a tool can't be found its bare name is used, so that running
+# it fails in process_data_with_command() with the usual error message.
+_OPENSSL = distutils.spawn.find_executable("openssl") or "openssl"
+_DER2ASCII = distutils.spawn.find_executable("der2ascii") or "der2ascii"
+_ASCII2DER = distutils.spawn.find_executable("ascii2der") or "ascii2der"
+
+# Commands run by process_data_with_command(), with the data being passed on
+# stdin.
+_OPENSSL_TEXT_COMMAND = (_OPENSSL, "x509", "-text", "-inform", "DER", "-noout")
+_OPENSSL_PEM_COMMAND = (_OPENSSL, "x509", "-inform", "DER", "-outform", "PEM")
+_OPENSSL_PKCS7_PRINT_CERTS_COMMAND = (_OPENSSL, "pkcs7", "-print_certs",
+                                      "-inform", "DER")
+_OPENSSL_CRL2PKCS7_COMMAND = (_OPENSSL, "crl2pkcs7", "-nocrl",
+                              "-certfile", "/dev/stdin", "-outform", "DER")
+_DER2ASCII_COMMAND = (_DER2ASCII,)
+_ASCII2DER_COMMAND = (_ASCII2DER,)
+
+# Leading whitespace on each line, excluding the newline that ends the previous
+# line.
+_INDENTATION_RE = re.compile(br'^[^\S\n]+', re.MULTILINE)
+
+_PEM_RE = re.compile(
+    br'-----BEGIN (CERTIFICATE|PKCS7)-----(.*?)-----END \1-----', re.DOTALL)
+
+_PEM_CERTIFICATE_RE = re.compile(
+    br'-----BEGIN CERTIFICATE-----\n.*?-----END CERTIFICATE-----\n', re.DOTALL)
+
+
 def read_file_to_string(path):
-  with open(path, 'r') as f:
+  with open(path, 'rb') as f:
     return f.read()
 
 
+def read_stdin_to_string():
+  """Reads all of stdin as bytes. Newline translation is disabled on Windows,
+  as it would corrupt DER input."""
+  if sys.platform == 'win32':
+    import msvcrt
+    msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+  return sys.stdin.read()
+
+
 def read_certificates_data_from_server(hostname):
   """Uses openssl to fetch the PEM-encoded certificates for an SSL server."""
-  p = subprocess.Popen(["openssl", "s_client", "-showcerts",
+  p = subprocess.Popen([_OPENSSL, "s_client", "-showcerts",
                         "-servername", hostname,
                         "-connect", hostname + ":443"],
                         stdin=subprocess.PIPE,
@@ -37,57 +83,94 @@ def read_certificates_data_from_server(hostname):
   return ""
 
 
-def read_sources_from_commandline(sources):
+# Timeout in seconds for each socket operation when fetching a server's
+# certificate in process. Without one a blackholed server would hang until the
+# OS connect timeout, and the wait in read_sources_from_commandline can't be
+# interrupted with Ctrl-C.
+_SERVER_FETCH_TIMEOUT_SECONDS = 30
+
+
+def read_certificates_data_from_server_in_process(hostname):
+  """Uses the ssl module to fetch the PEM-encoded certificate for an SSL
+  server. This avoids spawning openssl, but unlike
+  read_certificates_data_from_server() only returns the server's own
+  certificate and not the rest of the chain that it sent."""
+  # The certificates are being fetched in order to examine them, so don't
+  # require them to verify.
+  context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+  context.verify_mode = ssl.CERT_NONE
+  try:
+    sock = socket.create_connection((hostname, 443),
+                                    timeout=_SERVER_FETCH_TIMEOUT_SECONDS)
+    try:
+      ssl_sock = context.wrap_socket(sock, server_hostname=hostname)
+      certificate_der = ssl_sock.getpeercert(binary_form=True)
+      ssl_sock.close()
+    finally:
+      sock.close()
+  except (socket.error, socket.timeout), e:
+    sys.stderr.write("Failed getting certificates for %s:\n%s\n" % (
+        hostname, e))
+    return ""
+
+  return der_to_pem(certificate_der)
+
+
+# Maps the --server-fetcher names to the functions used to fetch the
+# certificates for a server.
+_SERVER_FETCHER_MAP = {
+    "openssl": read_certificates_data_from_server,
+    "python": read_certificates_data_from_server_in_process}
+
+
+def read_source(read_server, arg):
+  """Returns the bytes for a single command-line source."""
+  # If the argument identifies a file path, read it
+  if os.path.exists(arg):
+    return read_file_to_string(arg)
+  # Otherwise treat it as a web server address.
+  return read_server(arg)
+
+
+def read_sources_from_commandline(
+    sources, read_server=read_certificates_data_from_server):
   """Processes the command lines and returns an array of all the sources
   bytes."""
-  sources_bytes = []
-
   if not sources:
     # If no command-line arguments were given to the program, read input from
     # stdin.
-    sources_bytes.append(sys.stdin.read())
-  else:
-    for arg in sources:
-      # If the argument identifies a file path, read it
-      if os.path.exists(arg):
-        sources_bytes.append(read_file_to_string(arg))
-      else:
-        # Otherwise treat it as a web server address.
-        sources_bytes.append(read_certificates_data_from_server(arg))
+    return [read_stdin_to_string()]
 
-  return sources_bytes
+  # Fetching from a server is dominated by network latency, so read all of the
+  # sources concurrently.
+  pool = multiprocessing.pool.ThreadPool(min(16, len(sources)))
+  try:
+    return pool.map(functools.partial(read_source, read_server), sources)
+  finally:
+    pool.close()
+    pool.join()
 
 
 def strip_indentation_whitespace(text):
   """Strips leading whitespace from each line."""
-  stripped_lines = [line.lstrip() for line in text.split("\n")]
-  return "\n".join(stripped_lines)
-
-
-def strip_all_whitespace(text):
-  pattern = re.compile(r'\s+')
-  return re.sub(pattern, '', text)
+  return _INDENTATION_RE.sub(b'', text)
 
 
 def extract_certificates_from_pem(pem_bytes):
-  certificates_der = []
-
-  regex = re.compile(
-      r'-----BEGIN (CERTIFICATE|PKCS7)-----(.*?)-----END \1-----', re.DOTALL)
-
-  for match in regex.finditer(pem_bytes):
-    der = base64.b64decode(strip_all_whitespace(match.group(2)))
-    if match.group(1) == 'CERTIFICATE':
-      certificates_der.append(der)
+  """Generates the DER for each certificate in |pem_bytes|, as it is parsed."""
+  for match in _PEM_RE.finditer(pem_bytes):
+    # b64decode skips over the line breaks and any other whitespace.
+    der = base64.b64decode(match.group(2))
+    if match.group(1) == b'CERTIFICATE':
+      yield der
     else:
-      certificates_der.extend(extract_certificates_from_der_pkcs7(der))
-
-  return certificates_der
+      for certificate_der in extract_certificates_from_der_pkcs7(der):
+        yield certificate_der
 
 
 def extract_certificates_from_der_pkcs7(der_bytes):
   pkcs7_certs_pem = process_data_with_command(
-      ['openssl','pkcs7','-print_certs', '-inform', 'DER'], der_bytes)
+      _OPENSSL_PKCS7_PRINT_CERTS_COMMAND, der_bytes)
   # The output will be one or more PEM encoded certificates.
   # (Or CRLS, but those will be ignored.)
   if pkcs7_certs_pem:
@@ -109,7 +192,8 @@ def extract_certificates_from_der_ascii(input_text):
 
   for match in regex.finditer(input_text):
     der_ascii_bytes = match.group(1)
-    der_bytes = process_data_with_command(["ascii2der"], der_ascii_bytes)
+    der_bytes = process_data_with_command(_ASCII2DER_COMMAND,
+                                          der_ascii_bytes)
     if der_bytes:
       certificates_der.append(der_bytes)
 
@@ -204,8 +288,29 @@ def extract_tls_certificate_message(netlog_text):
   return decode_tls_certificate_message(raw_certificate_message)
 
 
+def looks_like_der(source_bytes):
+  """Returns True if |source_bytes| starts like the DER encoding of a
+  certificate or PKCS #7 signedData: a SEQUENCE tag followed by a long-form
+  length. Neither byte can start any of the text formats."""
+  return (len(source_bytes) >= 2 and source_bytes[0] == b"\x30" and
+          ord(source_bytes[1]) & 0x80 != 0)
+
+
+def extract_certificates_from_der(der_bytes):
+  # DER encoding of PKCS #7 signedData OID (1.2.840.113549.1.7.2)
+  if "\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x02" in der_bytes:
+    return extract_certificates_from_der_pkcs7(der_bytes)
+
+  # Otherwise assume it is the DER for a single certificate
+  return [der_bytes]
+
+
 def extract_certificates(source_bytes):
-  if "BEGIN CERTIFICATE" in source_bytes or "BEGIN PKCS7" in source_bytes:
+  # Avoid scanning the whole of a binary input for the text format markers.
+  if looks_like_der(source_bytes):
+    return extract_certificates_from_der(source_bytes)
+
+  if b"BEGIN CERTIFICATE" in source_bytes or b"BEGIN PKCS7" in source_bytes:
     return extract_certificates_from_pem(source_bytes)
 
   if "SEQUENCE {" in source_bytes:
@@ -214,15 +319,10 @@ def extract_certificates(source_bytes):
   if "SSL_HANDSHAKE_MESSAGE_RECEIVED" in source_bytes:
     return extract_tls_certificate_message(source_bytes)
 
-  # DER encoding of PKCS #7 signedData OID (1.2.840.113549.1.7.2)
-  if "\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x02" in source_bytes:
-    return extract_certificates_from_der_pkcs7(source_bytes)
-
-  # Otherwise assume it is the DER for a single certificate
-  return [source_bytes]
+  return extract_certificates_from_der(source_bytes)
 
 
-def process_data_with_command(command, data):
+def process_data_with_command(command, data, report_errors=True):
   try:
     p = subprocess.Popen(command,
                          stdin=subprocess.PIPE,
@@ -230,7 +330,8 @@ def process_data_with_command(command, data):
                          stderr=subprocess.PIPE)
   except OSError, e:
     if e.errno == errno.ENOENT:
-      sys.stderr.write("Failed to execute %s\n" % command[0])
+      if report_errors:
+        sys.stderr.write("Failed to execute %s\n" % command[0])
       return ""
     raise
 
@@ -240,28 +341,61 @@ def process_data_with_command(command, data):
     return result[0]
 
   # Otherwise failed.
-  sys.stderr.write("Failed: %s: %s\n" % (" ".join(command), result[1]))
+  if report_errors:
+    sys.stderr.write("Failed: %s: %s\n" % (" ".join(command), result[1]))
   return ""
 
 
 def openssl_text_pretty_printer(certificate_der, unused_certificate_number):
-  return process_data_with_command(["openssl", "x509", "-text", "-inform",
-                                   "DER", "-noout"], certificate_der)
+  return process_data_with_command(_OPENSSL_TEXT_COMMAND, certificate_der)
 
 
 def pem_pretty_printer(certificate_der, unused_certificate_number):
-  return process_data_with_command(["openssl", "x509", "-inform", "DER",
-                                   "-outform", "PEM"], certificate_der)
+  return process_data_with_command(_OPENSSL_PEM_COMMAND, certificate_der)
+
+
+def der_to_pem(certificate_der):
+  return ("-----BEGIN CERTIFICATE-----\n" +
+          base64.encodestring(certificate_der) +
+          "-----END CERTIFICATE-----\n")
+
+
+def batch_pem_pretty_print(certificates_der):
+  """Produces the same output as pem_pretty_printer for every certificate in
+  |certificates_der|, using two openssl invocations in total rather than one
+  per certificate.
+
+  Returns None if the certificates could not be processed as a batch, in which
+  case the caller should fall back to pem_pretty_printer (which will report
+  any errors)."""
+  pkcs7_der = process_data_with_command(
+      _OPENSSL_CRL2PKCS7_COMMAND,
+      "".join(der_to_pem(certificate_der)
+              for certificate_der in certificates_der),
+      report_errors=False)
+  if not pkcs7_der:
+    return None
+
+  pkcs7_certs_pem = process_data_with_command(
+      _OPENSSL_PKCS7_PRINT_CERTS_COMMAND, pkcs7_der, report_errors=False)
+  certificates_pem = _PEM_CERTIFICATE_RE.findall(pkcs7_certs_pem)
+  # crl2pkcs7 will fail outright on a certificate it cannot parse, but check
+  # that nothing was dropped before relying on the ordering.
+  if len(certificates_pem) != len(certificates_der):
+    return None
+  return certificates_pem
 
 
 def der2ascii_pretty_printer(certificate_der, unused_certificate_number):
-  return process_data_with_command(["der2ascii"], certificate_der)
+  return process_data_with_command(_DER2ASCII_COMMAND, certificate_der)
+
+
+_HEADER_BAR = "=" * 43
+_HEADER_FORMAT = _HEADER_BAR + "\nCertificate%d\n" + _HEADER_BAR
 
 
 def header_pretty_printer(unused_certificate_der, certificate_number):
-  return """===========================================
-Certificate%d
-===========================================""" % certificate_number
+  return _HEADER_FORMAT % certificate_number
 
 
 # This is actually just used as a magic value, since pretty_print_certificates
@@ -270,40 +404,107 @@ def der_printer():
   raise RuntimeError
 
 
+# Maps the --output names to the corresponding pretty printers.
+_OUTPUT_MAP = {"der2ascii": der2ascii_pretty_printer,
+               "openssl_text": openssl_text_pretty_printer,
+               "pem": pem_pretty_printer,
+               "header": header_pretty_printer,
+               "der": der_printer}
+
+
+def run_pretty_printer(job):
+  pretty_printer, certificate_der, certificate_number = job
+  return pretty_printer(certificate_der, certificate_number)
+
+
+def run_pretty_printers_concurrently(pool, jobs):
+  """Runs each of |jobs| on |pool|, generating their results in order.
+
+  |jobs| is iterated on the calling thread rather than by the pool, so that an
+  exception raised while producing the jobs (e.g. from extracting a malformed
+  certificate) propagates to the caller."""
+  pending_results = collections.deque()
+  for job in jobs:
+    pending_results.append(pool.apply_async(run_pretty_printer, (job,)))
+    # Generate whatever has already finished, so output can start before all
+    # of the jobs have been produced.
+    while pending_results and pending_results[0].ready():
+      yield pending_results.popleft().get()
+  while pending_results:
+    yield pending_results.popleft().get()
+
+
+def make_batched_pretty_printer(batched_results):
+  """Returns a pretty printer that looks up the output for each certificate in
+  |batched_results|, which was produced for the whole chain at once."""
+  def batched_pretty_printer(unused_certificate_der, certificate_number):
+    return batched_results[certificate_number]
+  return batched_pretty_printer
+
+
 def pretty_print_certificates(certificates_der, pretty_printers):
+  """Generates the pretty-printed output for |certificates_der| in chunks.
+
+  |certificates_der| can be any iterable, and is consumed lazily unless the
+  selected outputs need the whole chain up front."""
   # Need to special-case DER output to avoid adding any newlines, and to
   # only allow a single certificate to be output.
   if pretty_printers == [der_printer]:
+    certificates_der = list(certificates_der)
     if len(certificates_der) > 1:
       sys.stderr.write("DER output only supports a single certificate, "
                        "ignoring %d remaining certs\n" % (
                            len(certificates_der) - 1))
-    return certificates_der[0]
-
-  result = ""
-  for i in range(len(certificates_der)):
-    certificate_der = certificates_der[i]
-    pretty = []
-    for pretty_printer in pretty_printers:
-      pretty_printed = pretty_printer(certificate_der, i)
+    yield certificates_der[0]
+    return
+
+  # Where possible, produce the output for the whole chain with one command
+  # rather than one per certificate.
+  if pem_pretty_printer in pretty_printers:
+    certificates_der = list(certificates_der)
+    if len(certificates_der) > 1:
+      certificates_pem = batch_pem_pretty_print(certificates_der)
+      if certificates_pem:
+        batched_pretty_printer = make_batched_pretty_printer(certificates_pem)
+        pretty_printers = [
+            batched_pretty_printer if pretty_printer == pem_pretty_printer
+            else pretty_printer for pretty_printer in pretty_printers]
+
+  # Most of the pretty printers shell out to a separate process, so run all of
+  # the (certificate, pretty printer) pairs concurrently, and yield the output
+  # in order as it becomes available.
+  jobs = ((pretty_printer, certificate_der, i)
+          for i, certificate_der in enumerate(certificates_der)
+          for pretty_printer in pretty_printers)
+  pool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+  try:
+    certificate_printed = False
+    for n, pretty_printed in enumerate(
+        run_pretty_printers_concurrently(pool, jobs), 1):
+      # Each pretty printer's output is terminated by a newline.
       if pretty_printed:
-        pretty.append(pretty_printed)
-    result += "\n".join(pretty) + "\n"
-  return result
+        yield pretty_printed
+        yield "\n"
+        certificate_printed = True
+      # Each certificate has one result per pretty printer, and is followed by
+      # a newline even if none of them produced any output.
+      if n % len(pretty_printers) == 0:
+        if not certificate_printed:
+          yield "\n"
+        certificate_printed = False
+  finally:
+    pool.close()
+    pool.join()
 
 
 def parse_outputs(outputs):
   pretty_printers = []
-  output_map = {"der2ascii": der2ascii_pretty_printer,
-                "openssl_text": openssl_text_pretty_printer,
-                "pem": pem_pretty_printer,
-                "header": header_pretty_printer,
-                "der": der_printer}
   for output_name in outputs.split(','):
-    if output_name not in output_map:
+    pretty_printer = _OUTPUT_MAP.get(output_name)
+    if pretty_printer is None:
       sys.stderr.write("Invalid output type: %s\n" % output_name)
       return []
-    pretty_printers.append(output_map[output_name])
+    pretty_printers.append(pretty_printer)
   if der_printer in pretty_printers and len(pretty_printers) > 1:
       sys.stderr.write("Output type der must be used alone.\n")
       return []
@@ -337,20 +538,29 @@ from NetLogs).''')
       default="header,der2ascii,openssl_text,pem",
       help='output formats to use. Default: %(default)s')
 
+  parser.add_argument(
+      '--server-fetcher', dest='server_fetcher', action='store',
+      default="openssl", choices=sorted(_SERVER_FETCHER_MAP),
+      help='''how to fetch the certificates for a server SOURCE.
+"python" avoids spawning an openssl process per server,
+but only returns the server's own certificate rather than
+the whole chain. Default: %(default)s''')
+
   args = parser.parse_args()
 
-  sources_bytes = read_sources_from_commandline(args.sources)
+  sources_bytes = read_sources_from_commandline(
+      args.sources, _SERVER_FETCHER_MAP[args.server_fetcher])
 
   pretty_printers = parse_outputs(args.outputs)
   if not pretty_printers:
     sys.stderr.write('No pretty printers selected.\n')
     sys.exit(1)
 
-  certificates_der = []
-  for source_bytes in sources_bytes:
-    certificates_der.extend(extract_certificates(source_bytes))
+  certificates_der = itertools.chain.from_iterable(
+      extract_certificates(source_bytes) for source_bytes in sources_bytes)
 
-  sys.stdout.write(pretty_print_certificates(certificates_der, pretty_printers))
+  for chunk in pretty_print_certificates(certificates_der, pretty_printers):
+    sys.stdout.write(chunk)
 
 
 if __name__ == "__main__":
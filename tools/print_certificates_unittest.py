@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Copyright 2017 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+
+import base64
+import unittest
+import print_certificates
+
+
+def make_pem(body):
+  return ('-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n' %
+          body)
+
+
+GOOD_PEM = make_pem(base64.b64encode('not really a certificate'))
+
+# A PEM block whose body is not valid base64.
+MALFORMED_PEM = make_pem('abc')
+
+
+def pretty_print(source_bytes, pretty_printers):
+  certificates_der = print_certificates.extract_certificates(source_bytes)
+  return ''.join(print_certificates.pretty_print_certificates(
+      certificates_der, pretty_printers))
+
+
+class PrettyPrintCertificatesTest(unittest.TestCase):
+  def testHeader(self):
+    """Tests that each certificate is printed in order."""
+    self.assertEqual(
+        pretty_print(GOOD_PEM + GOOD_PEM,
+                     [print_certificates.header_pretty_printer]),
+        print_certificates.header_pretty_printer(None, 0) + '\n' +
+        print_certificates.header_pretty_printer(None, 1) + '\n')
+
+  def testMalformedPem(self):
+    """Tests that errors extracting the certificates are propagated."""
+    self.assertRaises(TypeError, pretty_print, MALFORMED_PEM,
+                      [print_certificates.header_pretty_printer])
+
+  def testMalformedPemAfterGoodPem(self):
+    """Tests that errors extracting a certificate are propagated after earlier
+    certificates have been handed to the pretty printers."""
+    self.assertRaises(TypeError, pretty_print, GOOD_PEM + MALFORMED_PEM,
+                      [print_certificates.header_pretty_printer])
+
+
+if __name__ == '__main__':
+  unittest.main()